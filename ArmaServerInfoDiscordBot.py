@@ -2,15 +2,15 @@
 
 import discord
 from discord.ext import commands
-import asyncio
 from ArmaServerQuery import *
-import sys, re
+import sys
 import yaml
-from operator import attrgetter
 from datetime import datetime
 
 # other parameters
 STORAGE_FILE = __file__[:-2] + "bin"
+# safe YAML loader, using the C implementation when available
+YAML_LOADER = getattr(yaml, "CSafeLoader", yaml.SafeLoader)
 
 def perror(*args, sep=" ", **kwargs):
 	'''
@@ -37,9 +37,15 @@ class ArmaServerInfoDiscordBot(commands.Bot):
 		except FileNotFoundError:
 			messageId = ""
 		self.message = discord.Object(id=messageId)
+		self.lastStatus = None
+		self.lastPresence = None
+		self.nextUpdateTime = None
+		self.updateHandle = None
+		self.updateTask = None
+		self.stopping = False
 		
 		# add background process
-		self.loop.create_task(self.backgroundProcInfoUpdate())
+		self.loop.create_task(self.startBackgroundProcInfoUpdate())
 		
 		# add event handlers
 		@self.event
@@ -48,15 +54,15 @@ class ArmaServerInfoDiscordBot(commands.Bot):
 			Executed when connected to Discord
 			'''
 			print("Logged in as", self.user.name)
+			# a new session starts without presence
+			self.lastPresence = None
 		
 		@self.command()
 		async def update():
 			'''
-			!update command: Posts server status
+			!update command: Refreshes server status
 			'''
-			self.ArmaServer.updateInfo()
-			embed = self.returnLatestStatus()
-			await self.send_status(embed=embed)
+			self.requestInfoUpdate()
 	
 	def run(self, *args, **kwargs):
 		'''
@@ -64,28 +70,78 @@ class ArmaServerInfoDiscordBot(commands.Bot):
 		'''
 		return super().run(self.botToken, *args, **kwargs)
 	
+	async def close(self):
+		'''
+		stops the status updates and closes the connection
+		'''
+		# set before awaiting, so a running update does not schedule another one
+		self.stopping = True
+		if self.updateHandle is not None:
+			self.updateHandle.cancel()
+		return await super().close()
+	
 	async def send_status(self, *args, **kwargs):
 		return await super().send_message(self.channel, *args, **kwargs)
 		
 	async def edit_status(self, *args, **kwargs):
 		return await super().edit_message(self.message, *args, **kwargs)
 	
-	async def backgroundProcInfoUpdate(self):
+	async def startBackgroundProcInfoUpdate(self):
 		'''
-		Background process that updates the server status regularly
+		Starts the regular status updates when connected to Discord
 		'''
 		await self.wait_until_ready()
-		while(not self.is_closed):
-			# To Do: make updateInfo suspendable
-			self.ArmaServer.updateInfo()
-			if self.ArmaServer.online:
-				map = self.ArmaServer.map if self.ArmaServer.map else "?"
-				BotGame = "Zeus on {} ({}/{})".format(map, *self.ArmaServer.playerNumbers)
-				await self.change_presence(game=discord.Game(name=BotGame), status="online")
-			else:
-				await self.change_presence(game=None, status="dnd")
+		if self.stopping:
+			return
+		self.nextUpdateTime = self.loop.time()
+		self.startInfoUpdate()
+	
+	def startInfoUpdate(self, scheduled=True):
+		'''
+		Runs a status update, called by the event loop on schedule or on request
+		'''
+		self.updateHandle = None
+		if scheduled:
+			# keep a fixed period regardless of the update duration
+			self.nextUpdateTime = max(self.nextUpdateTime + self.infoUpdateTimeout, self.loop.time())
+		self.updateTask = self.loop.create_task(self.backgroundProcInfoUpdate())
+	
+	def requestInfoUpdate(self):
+		'''
+		Runs a status update right away, unless one is already running
+		'''
+		if self.stopping or self.nextUpdateTime is None or not (self.updateTask is None or self.updateTask.done()):
+			return
+		if self.updateHandle is not None:
+			self.updateHandle.cancel()
+		self.updateHandle = self.loop.call_soon(self.startInfoUpdate, False)
+	
+	async def backgroundProcInfoUpdate(self):
+		'''
+		Background process that updates the server status once and schedules the next update
+		'''
+		try:
+			await self.ArmaServer.updateInfo()
+			await self.updatePresence()
 			await self.postLatestStatus()
-			await asyncio.sleep(self.infoUpdateTimeout)
+		finally:
+			if not self.stopping and not self.is_closed:
+				self.updateHandle = self.loop.call_at(self.nextUpdateTime, self.startInfoUpdate)
+	
+	async def updatePresence(self):
+		'''
+		Shows the server status as presence, unless it is already shown
+		'''
+		if self.ArmaServer.online:
+			map = self.ArmaServer.map if self.ArmaServer.map else "?"
+			presence = ("Zeus on {} ({}/{})".format(map, *self.ArmaServer.playerNumbers), "online")
+		else:
+			presence = (None, "dnd")
+		if presence == self.lastPresence:
+			return
+		BotGame, status = presence
+		await self.change_presence(game=discord.Game(name=BotGame) if BotGame else None, status=status)
+		self.lastPresence = presence
 	
 	def returnLatestStatus(self):
 		underscore = 44*"─"
@@ -98,7 +154,7 @@ class ArmaServerInfoDiscordBot(commands.Bot):
 		name = self.ArmaServer.name if self.ArmaServer.name else "Unknown Server Name"
 		embed = discord.Embed(title=name, description=underscore, color=color)
 		currentTime = datetime.utcnow().strftime("%H:%M:%S")
-		embed.add_field(name="Query Time:", value="{} (UTC)".format(currentTime), inline=False)
+		embed.set_footer(text="Last change: {} (UTC)".format(currentTime))
 		embed.add_field(name="Status:", value=status, inline=False)
 		embed.add_field(name="Address:", value="steam://connect/{}:{}".format(*self.ArmaServer.query.address), inline=False)
 		map = self.ArmaServer.map if self.ArmaServer.map else "none" 
@@ -106,24 +162,32 @@ class ArmaServerInfoDiscordBot(commands.Bot):
 		mission = self.ArmaServer.mission if self.ArmaServer.mission else "none" 
 		embed.add_field(name="Mission:", value=mission, inline=False)
 		embed.add_field(name="Player Count:", value="{}/{}".format(*self.ArmaServer.playerNumbers), inline=False)
-		if len(self.ArmaServer.playerList) > 0:		
-			lines=["```py"]
-			for player in sorted(self.ArmaServer.playerList, key=attrgetter("name")):
-				lines.append("• {} ({})".format(player.name, player.time, player.score, ))
-			lines.append("```")
-			embed.add_field(name="Player List:", value="\n".join(lines), inline=False)
+		if len(self.ArmaServer.playerList) > 0:
+			lines = "\n".join(f"• {player.name} ({player.time})" for player in self.ArmaServer.playerList)
+			embed.add_field(name="Player List:", value="```py\n" + lines + "\n```", inline=False)
 		return embed
 	
+	def returnStatusContent(self):
+		'''
+		returns the server data shown in the status message
+		'''
+		server = self.ArmaServer
+		players = tuple((player.name, player.time) for player in server.playerList)
+		return (server.online, server.name, server.map, server.mission, server.playerNumbers, players)
+	
 	async def postLatestStatus(self):
-		embed = self.returnLatestStatus()
+		content = self.returnStatusContent()
 		try:
 			try:
 				self.message = await self.get_message(self.channel, self.message.id)
-				await self.edit_status(embed=embed)
+				# skip the edit when the displayed data has not changed
+				if content != self.lastStatus:
+					await self.edit_status(embed=self.returnLatestStatus())
 			except discord.errors.NotFound:
-				self.message = await self.send_status(embed=embed)
+				self.message = await self.send_status(embed=self.returnLatestStatus())
 				with open(STORAGE_FILE, "wb") as file:
 					file.write(int(self.message.id).to_bytes(8, byteorder="big"))
+			self.lastStatus = content
 		except discord.errors.HTTPException as message:
 			perror("Discord HTTP error:", message)
 
@@ -131,12 +195,12 @@ if __name__ == "__main__":
 	# load configuration file
 	with open(__file__[:-2] + "yaml", "r") as configStream:
 		try:
-			config = yaml.load(configStream)
+			config = yaml.load(configStream, Loader=YAML_LOADER)
 		except yaml.YAMLError as error:
 			perror("YAML parsing error:", error)
 			sys.exit(1)
 	# create instance of the Arma Server Query API
-	AchillesPublicServer = ArmaServer(config["arma_server_query"]["server_address"], maxResponseTimeout=config["arma_server_query"]["max_response_timeout"])
+	AchillesPublicServer = ArmaServer(config["arma_server_query"]["server_address"], maxResponseTimeout=config["arma_server_query"]["max_response_timeout"], cacheTTL=config["discord_bot"]["info_update_timeout"] // 2)
 	# create and run the bot
 	bot = ArmaServerInfoDiscordBot(config["discord_bot"]["token"], AchillesPublicServer, command_prefix="!", channelId=config["discord_bot"]["channel_id"], infoUpdateTimeout=config["discord_bot"]["info_update_timeout"])
 	try:
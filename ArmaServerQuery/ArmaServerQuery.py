@@ -1,148 +1,281 @@
 #!/usr/bin/env python3
 
-# communication via internet and UDP
-from socket import socket, gethostname, AF_INET, SOCK_DGRAM, timeout
-from struct import unpack
+# asynchronous communication via internet and UDP
+import asyncio
+from time import monotonic
+from math import isfinite
+from socket import AF_INET, SOCK_DGRAM, SOL_SOCKET, SO_RCVBUF
+from struct import Struct, error as StructError
+from operator import attrgetter
 
 # test host address
 HOST_ADDRESS = ("127.0.0.1", 2302)
 # default maximal query response timeout
 DEFAULT_MAX_RESPONSE_TIMEOUT = None
-# set default buffer size
-DEFAUL_BUFFER_SIZE = 1400
+# default time in seconds for which query results are reused
+DEFAULT_CACHE_TTL = 0
+# default receive buffer size of the query socket
+DEFAULT_RECV_BUFFER_SIZE = 1 << 20
 
 # define requests
 A2S_INFO = "ÿÿÿÿTSource Engine Query\0".encode("iso-8859-1")
 A2S_PLAYER_PREFIX = "ÿÿÿÿU".encode("iso-8859-1")
 A2S_PLAYER_CHALLENGE_POSTFIX = "ÿÿÿÿ".encode("iso-8859-1")
+A2S_PLAYER_CHALLENGE_REQUEST = A2S_PLAYER_PREFIX + A2S_PLAYER_CHALLENGE_POSTFIX
+# define response headers
+S2A_INFO = "I".encode("iso-8859-1")
+S2A_PLAYER = "D".encode("iso-8859-1")
+S2C_CHALLENGE = "A".encode("iso-8859-1")
+
+# player and maximal player count following the app ID (short)
+A2S_INFO_PLAYER_NUMBERS = Struct("<2xBB")
+# score (long) and time (float) following each player name
+A2S_PLAYER_RECORD = Struct("<lf")
+# separator for decoding all player names at once
+NAME_SEPARATOR = "\x1f"
+NAME_SEPARATOR_BYTES = NAME_SEPARATOR.encode("iso-8859-1")
 
 class Player:
 	'''
 	Player data storage object
 	'''
+	__slots__ = ("name", "score", "time")
+	
 	def __init__(self, name):
 		self.name = name
 		self.score = 0
 		self.time = ""
 
+class SteamQueryProtocol(asyncio.DatagramProtocol):
+	'''
+	Datagram protocol that passes responses to the oldest pending query with
+	the same source address and header
+	'''
+	__slots__ = ("futures", "sendError")
+	
+	def __init__(self):
+		self.futures = {}
+		self.sendError = None
+	
+	def datagram_received(self, data, address):
+		for future in self.futures.get((address, data[4:5]), ()):
+			if not future.done():
+				future.set_result(data)
+				break
+	
+	def error_received(self, error):
+		# the endpoint is shared and the error does not tell the destination,
+		# so only the request that is sending right now picks it up
+		self.sendError = error
+
 class SteamServerQuery:
 	'''
 	Steam server query API for ArmA 3
 	'''
-	def __init__(self, server, address=(), maxResponseTimeout=DEFAULT_MAX_RESPONSE_TIMEOUT, bufferSize=DEFAUL_BUFFER_SIZE):
+	# endpoint shared by all queries on an event loop
+	sharedEndpointLoop = None
+	sharedEndpointTask = None
+	
+	__slots__ = ("server", "address", "socketAddress", "endpointTask", "transport", "protocol", "sendto", "futures", "response", "maxResponseTimeout", "shareEndpoint", "recvBufferSize", "infoResponse", "playerRequest")
+	
+	def __init__(self, server, address=(), maxResponseTimeout=DEFAULT_MAX_RESPONSE_TIMEOUT, shareEndpoint=True, recvBufferSize=DEFAULT_RECV_BUFFER_SIZE):
 		self.server = server
 		if not address:
 			self.address = self.server.address
 		else:
 			self.address = address
-		self.client = None
+		self.socketAddress = None
+		self.endpointTask = None
+		self.transport = None
+		self.protocol = None
+		self.sendto = None
+		self.futures = None
 		self.response = b""
 		self.maxResponseTimeout = maxResponseTimeout
-		self.bufferSize = bufferSize
+		self.shareEndpoint = shareEndpoint
+		self.recvBufferSize = recvBufferSize
+		# last parsed A2S_INFO response
+		self.infoResponse = None
+		# player request, updated in place with the current challenge
+		self.playerRequest = bytearray(A2S_PLAYER_CHALLENGE_REQUEST)
 	
-	def createClientSocket(self):
+	@staticmethod
+	async def createEndpoint(recvBufferSize=DEFAULT_RECV_BUFFER_SIZE):
+		'''
+		creates a new datagram endpoint with the given receive buffer size
+		'''
+		loop = asyncio.get_event_loop()
+		transport, protocol = await loop.create_datagram_endpoint(SteamQueryProtocol, family=AF_INET)
+		# a larger buffer avoids dropped replies when many servers answer at once
+		if recvBufferSize:
+			transport.get_extra_info("socket").setsockopt(SOL_SOCKET, SO_RCVBUF, recvBufferSize)
+		return(transport, protocol)
+	
+	@classmethod
+	async def sharedEndpoint(cls, recvBufferSize=DEFAULT_RECV_BUFFER_SIZE):
+		'''
+		returns the datagram endpoint shared by all queries on the running event loop,
+		the receive buffer size only applies when it is created
 		'''
-		creats a new client socket
+		loop = asyncio.get_event_loop()
+		task = cls.sharedEndpointTask
+		# create it once per loop, and again after a failed attempt
+		if task is None or cls.sharedEndpointLoop is not loop or (task.done() and (task.cancelled() or task.exception() is not None)):
+			cls.sharedEndpointLoop = loop
+			cls.sharedEndpointTask = task = loop.create_task(cls.createEndpoint(recvBufferSize))
+		return(await asyncio.shield(task))
+	
+	async def createClientEndpoint(self):
+		'''
+		sets up the client endpoint once, also for concurrent requests
+		'''
+		if self.transport is not None:
+			return
+		task = self.endpointTask
+		# set it up again after a failed attempt
+		if task is None or (task.done() and (task.cancelled() or task.exception() is not None)):
+			self.endpointTask = task = asyncio.get_event_loop().create_task(self.setupClientEndpoint())
+		await asyncio.shield(task)
+	
+	async def setupClientEndpoint(self):
 		'''
-		if self.client is None:
-			client = socket(AF_INET, SOCK_DGRAM)
-			client.settimeout(self.maxResponseTimeout)
-			self.client = client
-	def A2S_INFO(self):
+		gets the shared or a new datagram endpoint and resolves the server address
+		'''
+		loop = asyncio.get_event_loop()
+		if self.socketAddress is None:
+			# replies are matched by the numeric address they come from
+			host, port = self.address
+			addressInfo = await loop.getaddrinfo(host, port, family=AF_INET, type=SOCK_DGRAM)
+			self.socketAddress = addressInfo[0][4]
+		if self.transport is None:
+			if self.shareEndpoint:
+				self.transport, self.protocol = await self.sharedEndpoint(self.recvBufferSize)
+			else:
+				self.transport, self.protocol = await self.createEndpoint(self.recvBufferSize)
+			# bind what every request uses to skip the attribute lookups
+			self.sendto = self.transport.sendto
+			self.futures = self.protocol.futures
+	
+	async def request(self, data, *headers):
+		'''
+		sends a request and waits for a response with one of the given headers
+		without blocking the event loop
+		'''
+		await self.createClientEndpoint()
+		future = asyncio.get_event_loop().create_future()
+		keys = [(self.socketAddress, header) for header in headers]
+		futures = self.futures
+		protocol = self.protocol
+		for key in keys:
+			futures.setdefault(key, []).append(future)
+		try:
+			# the transport reports a failed send through error_received
+			protocol.sendError = None
+			self.sendto(data, self.socketAddress)
+			if protocol.sendError is not None:
+				raise protocol.sendError
+			self.response = await asyncio.wait_for(future, self.maxResponseTimeout)
+		finally:
+			for key in keys:
+				futures[key].remove(future)
+				if not futures[key]:
+					del futures[key]
+		return(self.response)
+	
+	async def A2S_INFO(self):
 		'''
 		Updates server attributes name, map, mission and playerNumbers
 		'''
-		self.createClientSocket()
 		# basic info query
 		try:
-			self.client.sendto(A2S_INFO , self.address)
-			self.response, _ = self.client.recvfrom(self.bufferSize)
-		except timeout:
+			response = await self.request(A2S_INFO, S2A_INFO)
+			# the server info rarely changes, so skip parsing a repeated response
+			if response == self.infoResponse:
+				return(0)
+			# split name, map, folder, game and the binary rest in a single pass
+			name, map, _, mission, rest = response[1 + response.index(b"\x11"):].split(b"\x00", 4)
+			playerNumbers = A2S_INFO_PLAYER_NUMBERS.unpack_from(rest)
+		except (asyncio.TimeoutError, OSError, ValueError, StructError):
+			self.infoResponse = None
 			self.server.map = ""
 			self.server.mission = ""
 			self.server.playerNumbers = (0,0)
 			self.server.playerList = []
 			return(1)
-		# get name
-		idx_start = 1 + self.response.find(b"\x11")
-		idx_end = self.response.find(b"\x00", idx_start)
-		name = self.response[idx_start:idx_end]
-		self.server.name = name.decode("UTF-8")
-		# get map
-		idx_start = 1 + idx_end
-		idx_end = self.response.find(b"\x00", idx_start)
-		map = self.response[idx_start:idx_end]
-		self.server.map = map.decode("UTF-8")
-		# get mission
-		idx_start = 1 + self.response.find(b"\x00", idx_end+1)
-		idx_end = self.response.find(b"\x00", idx_start)
-		mission = self.response[idx_start:idx_end]
-		self.server.mission = mission.decode("UTF-8")
-		# get player numbers
-		idx = 3 + self.response.find(b"\x00", idx_end)
-		playerCount = int.from_bytes(self.response[idx:idx+1], byteorder="big")
-		playerMaxCount = int.from_bytes(self.response[idx+1:idx+2], byteorder="big")
-		self.server.playerNumbers = (playerCount,playerMaxCount)
+		self.server.name = name.decode("UTF-8", errors="replace")
+		self.server.map = map.decode("UTF-8", errors="replace")
+		self.server.mission = mission.decode("UTF-8", errors="replace")
+		self.server.playerNumbers = playerNumbers
+		self.infoResponse = response
 		return(0)
 	
-	def A2S_PLAYER(self):
+	async def A2S_PLAYER(self):
 		'''
 		Updates player data
 		'''
-		self.createClientSocket()
-		# challenge query
-		try:
-			self.client.sendto(A2S_PLAYER_PREFIX + A2S_PLAYER_CHALLENGE_POSTFIX, self.address)
-			self.response, _ = self.client.recvfrom(self.bufferSize)
-		except timeout:
-			self.server.playerList = []
-			return(1)
-		A2S_PLAYER_POSTFIX = self.response[5:]
-		# player info query
+		# player info query with the last challenge, which stays valid for a while
 		try:
-			self.client.sendto(A2S_PLAYER_PREFIX + A2S_PLAYER_POSTFIX, self.address)
-			self.response, _ = self.client.recvfrom(self.bufferSize)
-		except timeout:
+			response = await self.request(self.playerRequest, S2C_CHALLENGE, S2A_PLAYER)
+			# repeat the query when the server replies with a new challenge
+			if response[4:5] == S2C_CHALLENGE:
+				if len(response) >= 9:
+					self.playerRequest[len(A2S_PLAYER_PREFIX):] = response[5:9]
+				else:
+					# a truncated challenge would shrink the request, ask for a new one
+					self.playerRequest[:] = A2S_PLAYER_CHALLENGE_REQUEST
+				response = await self.request(self.playerRequest, S2C_CHALLENGE, S2A_PLAYER)
+		except (asyncio.TimeoutError, OSError):
 			self.server.playerList = []
 			return(1)
-		# exit when the response is repeated
-		if(A2S_PLAYER_POSTFIX == self.response[5:]):
+		# exit when the server keeps replying with a challenge
+		if(response[4:5] != S2A_PLAYER):
 			self.server.playerList = []
 			return(1)
-		# get player data
+		# get player data, slicing names from a view instead of copying them
 		self.server.playerList = []
-		idx_start = 1 + self.response.find(b"\x00")
-		idx_max = len(self.response) - 1;
-		while(idx_start <= idx_max):
-			# get name
-			idx_end = self.response.find(b"\x00", idx_start)
-			# exit when date is incomplete
-			if idx_end < 0:
-				break
-			name = self.response[idx_start:idx_end]
-			player = Player(name.decode("UTF-8"))
-			# get score
-			idx = 1 + idx_end
-			# exit when date is incomplete
-			if idx+7 > idx_max:
-				break
-			player.score = int(self.response[idx])
-			# get time
-			seconds = unpack("f", self.response[idx+4:idx+8])[0]
-			minutes, seconds = divmod(seconds, 60)
-			hours, minutes = divmod(minutes, 60)
-			player.time = "{:02}:{:02}".format(int(hours), int(minutes))
-			# add player
-			self.server.playerList.append(player)
-			# get next player
-			idx_start = idx+9
+		names = []
+		view = memoryview(response)
+		# the player count follows the header, then each record starts with an
+		# index byte; a truncated record raises and ends the loop
+		try:
+			idx_start = 7
+			for _ in range(response[5]):
+				# get name
+				idx_end = response.index(b"\x00", idx_start)
+				# get score and time
+				score, seconds = A2S_PLAYER_RECORD.unpack_from(response, idx_end + 1)
+				names.append(view[idx_start:idx_end])
+				player = Player("")
+				player.score = score
+				# some servers report an infinite or undefined time
+				if isfinite(seconds):
+					hours, seconds = divmod(int(seconds), 3600)
+					player.time = f"{hours:02d}:{seconds // 60:02d}"
+				else:
+					player.time = "--:--"
+				# add player
+				self.server.playerList.append(player)
+				# get next player, skipping its index byte
+				idx_start = idx_end + A2S_PLAYER_RECORD.size + 2
+		except (IndexError, ValueError, StructError):
+			pass
+		# decode all names in one call, unless a name contains the separator
+		decodedNames = NAME_SEPARATOR_BYTES.join(names).decode("UTF-8", errors="replace").split(NAME_SEPARATOR)
+		if len(decodedNames) != len(names):
+			decodedNames = [str(name, "UTF-8", errors="replace") for name in names]
+		for player, name in zip(self.server.playerList, decodedNames):
+			player.name = name
+		# sort once here instead of on every status render
+		self.server.playerList.sort(key=attrgetter("name"))
 		return(0)
 
 class ArmaServer:
 	'''
 	Server data storage object
 	'''
-	def __init__(self, address, **kwargs):
+	__slots__ = ("address", "name", "map", "mission", "playerList", "playerNumbers", "online", "query", "cacheTTL", "lastUpdateTime", "lastUpdateStatus", "updateLock")
+	
+	def __init__(self, address, cacheTTL=DEFAULT_CACHE_TTL, **kwargs):
 		self.address = address
 		self.name = ""
 		self.map = ""
@@ -152,15 +285,36 @@ class ArmaServer:
 		self.online = False
 		ip, port = address
 		self.query = SteamServerQuery(self, (ip, port+1), **kwargs)
-	def updateInfo(self):
-		# update basic info
-		status1 = self.query.A2S_INFO()
+		self.cacheTTL = cacheTTL
+		self.lastUpdateTime = None
+		self.lastUpdateStatus = 1
+		self.updateLock = asyncio.Lock()
+	async def updateInfo(self):
+		'''
+		Updates the server data, unless the last update is younger than cacheTTL
+		'''
+		# concurrent callers wait for the running update and share its result
+		async with self.updateLock:
+			if self.lastUpdateTime is not None and monotonic() - self.lastUpdateTime < self.cacheTTL:
+				return(self.lastUpdateStatus)
+			self.lastUpdateStatus = await self.queryInfo()
+			self.lastUpdateTime = monotonic()
+			return(self.lastUpdateStatus)
+	@classmethod
+	async def updateInfoAll(cls, servers):
+		'''
+		Updates several servers concurrently, so the total time is bounded by
+		the slowest server instead of the sum of all round trips
+		'''
+		return(await asyncio.gather(*(server.updateInfo() for server in servers)))
+	async def queryInfo(self):
+		# update basic and player info concurrently
+		status1, status2 = await asyncio.gather(self.query.A2S_INFO(), self.query.A2S_PLAYER())
 		# update online status
 		self.online = (status1 == 0)
-		# update player info
-		if(self.online):
-			status2 = self.query.A2S_PLAYER()
-		else:
+		# drop player info of an offline server
+		if(not self.online):
+			self.playerList = []
 			status2 = 1
 		return(status1 | status2)
 	def __str__(self):
@@ -169,7 +323,7 @@ class ArmaServer:
 if __name__ == "__main__":
 	# test run
 	AchillesPublicServer = ArmaServer(HOST_ADDRESS)
-	AchillesPublicServer.updateInfo()
-	print(AchillesPublicServer.__dict__)
+	asyncio.get_event_loop().run_until_complete(AchillesPublicServer.updateInfo())
+	print({attr: getattr(AchillesPublicServer, attr) for attr in ArmaServer.__slots__})
 	for player in AchillesPublicServer.playerList:
-		print(player.__dict__)
+		print({attr: getattr(player, attr) for attr in Player.__slots__})